@@ -1,9 +1,9 @@
 import logging
 import os
-import queue
 import subprocess
 import time
-from typing import Any, Tuple
+from collections import deque
+from typing import Any, Deque, Tuple
 
 from tools.base_server import ABCToolDriver
 
@@ -21,16 +21,19 @@ def kill_vworks() -> None:
         )
         time.sleep(0.1)
     except Exception as e:
-        logging.warning(f"Failed to kill VWorks on clean up: {e}")
+        logging.warning("Failed to kill VWorks on clean up: %s", e)
 
 
 EventType = Tuple[str, Any]
-EventQueue = queue.Queue
+# Events are appended by the COM sink while PumpWaitingMessages runs and consumed
+# by wait_for_protocol_completion on that same STA thread, so no locking is needed.
+EventQueue = Deque[EventType]
 
 
 if os.name == "nt":
     import comtypes.client as cc  # type: ignore
     import pythoncom
+    import win32event
 
     # from comtypes import GUID
     from comtypes.client import GetEvents
@@ -40,13 +43,13 @@ if os.name == "nt":
             self.event_queue = event_queue
 
         def InitializationComplete(self, *args: Any) -> int:
-            logging.info(f"Initialization complete: {args}")
-            self.event_queue.put(("InitializationComplete", args))
+            logging.info("Initialization complete: %s", args)
+            self.event_queue.append(("InitializationComplete", args))
             return 0
 
         def InitializationCompleteWithCode(self, *args: Any) -> int:
-            logging.info(f"Initialization complete with code: {args}")
-            self.event_queue.put(("InitializationCompleteWithCode", args))
+            logging.info("Initialization complete with code: %s", args)
+            self.event_queue.append(("InitializationCompleteWithCode", args))
             return 0
 
         def LogMessage(self, *args: Any) -> int:
@@ -57,7 +60,7 @@ if os.name == "nt":
         # def MessageBoxAction(self, *args):
         #     message = args[2] if len(args) > 2 else "Unknown message"
         #     print(f"Message box action: {message}")
-        #     self.event_queue.put(("MessageBoxAction", message))
+        #     self.event_queue.append(("MessageBoxAction", message))
 
         #     # Return explicit button choice (1 = OK, 2 = Cancel)
         #     # For compiler errors, choose Cancel (2) which is recommended
@@ -69,28 +72,28 @@ if os.name == "nt":
         # def UserMessage(self, *args):
         #     message = args[1] if len(args) > 1 else "Unknown message"
         #     print(f"User message: {message}")
-        #     self.event_queue.put(("UserMessage", message))
+        #     self.event_queue.append(("UserMessage", message))
         #     return 0
 
         def ProtocolComplete(self, *args: Any) -> None:
             protocol = args[1] if len(args) > 1 else "unknown"
-            logging.info(f"Protocol completed: {protocol}")
-            self.event_queue.put(("ProtocolComplete", protocol))
+            logging.info("Protocol completed: %s", protocol)
+            self.event_queue.append(("ProtocolComplete", protocol))
 
         def ProtocolAborted(self, *args: Any) -> None:
             protocol = args[1] if len(args) > 1 else "unknown"
-            logging.error(f"Protocol aborted: {protocol}")
-            self.event_queue.put(("ProtocolAborted", protocol))
+            logging.error("Protocol aborted: %s", protocol)
+            self.event_queue.append(("ProtocolAborted", protocol))
 
         def UnrecoverableError(self, *args: Any) -> None:
             description = args[1] if len(args) > 1 else "unknown error"
-            logging.error(f"Unrecoverable error: {description}")
-            self.event_queue.put(("UnrecoverableError", description))
+            logging.error("Unrecoverable error: %s", description)
+            self.event_queue.append(("UnrecoverableError", description))
 
         def RecoverableError(self, *args: Any) -> None:
             description = args[3] if len(args) > 3 else "unknown error"
-            logging.error(f"Recoverable error: {description}")
-            self.event_queue.put(("RecoverableError", description))
+            logging.error("Recoverable error: %s", description)
+            self.event_queue.append(("RecoverableError", description))
 
             # If we have action parameters
             if len(args) > 4:
@@ -134,14 +137,22 @@ else:
 class BravoDriver(ABCToolDriver):
     def __init__(self, init_com: bool = False):
         self.live = False
-        self.event_queue = queue.Queue()
+        self.event_queue: EventQueue = deque()
         self.event_connection = None
         self.driver: VWorks4API
+        self.closed = False
+        # Set once a protocol or runset has been handed to VWorks and cleared when it
+        # completes; while set, VWorks may still be executing it
+        self.run_started = False
+        # Only uninitialize COM on cleanup if this driver initialized it; otherwise the
+        # owning thread's apartment would be torn down underneath it
+        self.com_initialized = False
 
         if os.name == "nt":
             kill_vworks()
             if init_com:
                 pythoncom.CoInitializeEx(pythoncom.COINIT_APARTMENTTHREADED)
+                self.com_initialized = True
                 logging.info("COM initialized in the driver")
             try:
                 self.driver = cc.CreateObject("VWorks4.VWorks4API")
@@ -149,7 +160,7 @@ class BravoDriver(ABCToolDriver):
                 self.event_connection = GetEvents(self.driver, self.event_sink)
                 self.show_vworks(True)
             except Exception as e:
-                logging.error(f"Failed to create VWorks COM object: {e}")
+                logging.error("Failed to create VWorks COM object: %s", e)
                 # Check if this is a COM initialization error
                 if "CoInitialize has not been called" in str(e):
                     logging.error(
@@ -159,18 +170,16 @@ class BravoDriver(ABCToolDriver):
 
     def __del__(self) -> None:
         try:
-            if hasattr(self, "driver") and self.driver:
+            if not self.closed and hasattr(self, "driver") and self.driver:
                 logging.info("Cleaning up BravoServer resources")
                 self.close()
 
             # Uninitialize COM in the same thread that initialized it
-            if os.name == "nt":
-                import pythoncom
-
+            if self.com_initialized:
                 logging.debug("Uninitializing COM in server thread")
                 pythoncom.CoUninitialize()
         except Exception as e:
-            logging.error(f"Error during BravoServer cleanup: {e}")
+            logging.error("Error during BravoServer cleanup: %s", e)
 
     def login(self, user: str = "administrator", psw: str = "administrator") -> None:
         self.driver.Login(user, psw)
@@ -181,49 +190,62 @@ class BravoDriver(ABCToolDriver):
             try:
                 self.driver.Logout()
             except Exception as e:
-                logging.warning(f"Error during logout: {e}")
+                logging.warning("Error during logout: %s", e)
+
+    def is_healthy(self) -> bool:
+        """Cheaply check that the VWorks COM server still answers calls"""
+        if os.name != "nt":
+            return False
+        try:
+            # Already shown before every run, so this is a no-op round-trip to VWorks
+            self.driver.ShowVWorks(True)
+            return True
+        except Exception as e:
+            logging.warning("VWorks health check failed: %s", e)
+            return False
 
     def show_vworks(self, show: bool = True) -> None:
-        logging.info(f"Showing VWorks window= {show}")
+        logging.info("Showing VWorks window= %s", show)
         self.driver.ShowVWorks(show)
 
-    def run_protocol(self, protocol: str) -> None:
-        if os.path.splitext(protocol)[1] != ".pro":
-            raise RuntimeError("Invalid file type. Must be .pro")
-
-        if not os.path.exists(protocol):
-            raise FileNotFoundError(f"{protocol} does not exist.")
+    @staticmethod
+    def _check_file(path: str, extension: str) -> None:
+        if os.path.splitext(path)[1] != extension:
+            raise RuntimeError(f"Invalid file type. Must be {extension}")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} does not exist.")
 
+    def run_protocol(self, protocol: str) -> None:
+        self._check_file(protocol, ".pro")
         try:
-            pythoncom.CoInitializeEx(pythoncom.COINIT_APARTMENTTHREADED)
             self.show_vworks()
-            logging.info(f"Loading protocol: {protocol}")
+            logging.info("Loading protocol: %s", protocol)
+            self.run_started = True
             self.driver.LoadProtocol(protocol)
 
-            logging.info(f"Running protocol: {protocol}")
+            logging.info("Running protocol: %s", protocol)
             self.driver.RunProtocol(protocol, 1)
 
-            logging.info(f"Waiting for protocol completion: {protocol}")
+            logging.info("Waiting for protocol completion: %s", protocol)
             success = self.wait_for_protocol_completion(protocol)
 
             if not success:
                 raise RuntimeError(f"Protocol did not complete successfully: {protocol}")
+            self.run_started = False
 
         except Exception as e:
             raise RuntimeError(f"Error running protocol {protocol}: {e}")
 
     def run_runset(self, runset_file: str) -> None:
-        if os.path.splitext(runset_file)[1] != ".rst":
-            raise RuntimeError("Invalid file type. Must be .rst")
-        if not os.path.exists(runset_file):
-            raise FileNotFoundError(f"{runset_file} does not exist.")
+        self._check_file(runset_file, ".rst")
         try:
-            pythoncom.CoInitializeEx(pythoncom.COINIT_APARTMENTTHREADED)
             self.show_vworks()
+            self.run_started = True
             self.driver.LoadRunsetFile(runset_file)
             success = self.wait_for_protocol_completion(runset_file)
             if not success:
                 raise RuntimeError(f"Runset did not complete successfully: {runset_file}")
+            self.run_started = False
         except Exception as e:
             raise RuntimeError(f"Error running runset {runset_file}:{e}")
 
@@ -237,26 +259,26 @@ class BravoDriver(ABCToolDriver):
             # Check if we've received completion events
             try:
                 # Non-blocking queue check
-                event_type, event_data = self.event_queue.get_nowait()
-                print(f"Event received: {event_type} - Data: {event_data}")
+                event_type, event_data = self.event_queue.popleft()
+                logging.debug("Event received: %s - Data: %s", event_type, event_data)
 
                 last_event_type = event_type
                 last_event_data = event_data
 
                 # For matching protocol names
                 if event_type == "ProtocolComplete":
-                    print(f"Protocol completion event received: {event_data}")
+                    logging.debug("Protocol completion event received: %s", event_data)
                     return True
                 elif event_type == "ProtocolAborted":
-                    print(f"Protocol aborted: {event_data}")
+                    logging.debug("Protocol aborted: %s", event_data)
                     raise RuntimeError(f"Protocol was aborted: {protocol_name}")
                 elif event_type == "UnrecoverableError":
-                    print(f"Unrecoverable error occurred: {event_data}")
+                    logging.debug("Unrecoverable error occurred: %s", event_data)
                     raise RuntimeError(f"Unrecoverable error: {event_data}")
                 elif event_type == "RecoverableError":
-                    print(f"Recoverable error occurred: {event_data}")
+                    logging.debug("Recoverable error occurred: %s", event_data)
                     # Continue execution for recoverable errors, but log it
-            except queue.Empty:
+            except IndexError:
                 # No events in the queue, continue waiting
                 pass
 
@@ -270,14 +292,18 @@ class BravoDriver(ABCToolDriver):
                     error_msg += ". No events were received"
                 raise TimeoutError(error_msg)
 
-            # Short sleep to avoid hammering the CPU
-            time.sleep(0.28)
+            # Block until the next window message (COM event) or the deadline rather
+            # than sleeping a fixed interval; don't wait while events are still queued
+            if not self.event_queue:
+                remaining_ms = int((timeout - (time.time() - start_time)) * 1000)
+                win32event.MsgWaitForMultipleObjects(
+                    [], False, max(remaining_ms, 0), win32event.QS_ALLINPUT
+                )
 
     def close(self) -> None:
         """Properly clean up resources"""
-        if self.driver:
-            self.driver.Logout()
-            self.event_connection = None
+        if self.closed:
+            return
         if os.name == "nt":
             try:
                 if hasattr(self, "driver") and self.driver:
@@ -285,15 +311,19 @@ class BravoDriver(ABCToolDriver):
                         self.driver.Logout()
                     except Exception as e:
                         logging.warning(
-                            f"Driver instanced closed before proper clean up. VWorks might have crashed, {e}"
+                            "Driver instanced closed before proper clean up. VWorks might have crashed, %s",
+                            e,
                         )
                 kill_vworks()
                 time.sleep(0.5)
-
-                if hasattr(self, "event_connection") and self.event_connection:
-                    self.event_connection = None
             except Exception as e:
-                logging.warning(f"Error during cleanup: {e}")
+                logging.warning("Error during cleanup: %s", e)
+
+        # Release the COM references here, on the thread that owns them, so a later
+        # __del__ (possibly run by the GC on another thread) has nothing to tear down
+        self.closed = True
+        self.driver = None  # type: ignore[assignment]
+        self.event_connection = None
 
 
 # if __name__ == "__main__":
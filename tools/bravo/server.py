@@ -1,93 +1,217 @@
 import argparse
 import logging
 import os
+import queue
 import threading
-import time
-from typing import Any, Callable
+from concurrent.futures import Future
+from typing import Any, Callable, Optional, Tuple
 
 from tools.base_server import ToolServer, serve
 from tools.grpc_interfaces.bravo_pb2 import Command, Config
 
 from .driver import BravoDriver, kill_vworks
 
-if os.name == "nt":
+_IS_WINDOWS = os.name == "nt"
+
+if _IS_WINDOWS:
     import pythoncom
+    import win32event
+
+    # Bound once here; these are called on every RPC
+    _co_initialize = pythoncom.CoInitialize
+    _co_uninitialize = pythoncom.CoUninitialize
+    _pump_waiting_messages = pythoncom.PumpWaitingMessages
+else:
+
+    def _no_com(*args: Any) -> Any:
+        return None
+
+    _co_initialize = _co_uninitialize = _pump_waiting_messages = _no_com
+
+# HRESULTs meaning the connection to the VWorks COM server was lost, so the call is
+# worth retrying. RPC_S_CALL_FAILED is deliberately absent: a VWorks that is still
+# running can return it, and retrying would send the same protocol a second time.
+_RPC_ERROR_HRESULTS = frozenset(
+    {
+        -2147023174,  # RPC_S_SERVER_UNAVAILABLE (0x800706BA)
+        -2147417848,  # RPC_E_DISCONNECTED (0x80010108)
+    }
+)
+
 
-_thread_local = threading.local()
+def _is_rpc_error(error: BaseException) -> bool:
+    """Check an error, and the COM errors it was raised from, for a lost VWorks connection"""
+    current: Optional[BaseException] = error
+    while current is not None:
+        if getattr(current, "hresult", None) in _RPC_ERROR_HRESULTS:
+            return True
+        current = current.__cause__ or current.__context__
+    return "RPC server is unavailable" in str(error)
+
+
+# A function for the STA worker, its arguments and the future its outcome is delivered through
+WorkItem = Tuple[Callable[..., Any], Tuple[Any, ...], "Future[Any]"]
 
 
 class BravoServer(ToolServer):
     toolType = "bravo"
+    # Threading: the VWorks driver and its COM objects are only created, used and
+    # closed on the STA worker. ToolServer state is not confined: Configure reassigns
+    # config, and ExecuteCommand writes status and last_error from any gRPC thread.
     config: Config
 
     def __init__(self) -> None:
         super().__init__()
         self.main_thread_id = threading.get_ident()
-        logging.info(f"BravoServer initialized in thread ID: {self.main_thread_id}")
-
-        # Initialize COM in the main thread
-        if os.name == "nt":
-            pythoncom.CoInitialize()
-            logging.info("COM initialized in main thread")
+        logging.info("BravoServer initialized in thread ID: %s", self.main_thread_id)
 
         # Flag to signal server shutdown
         self.shutdown = False
 
+        # The VWorks driver is created, used and closed on one dedicated STA thread.
+        # gRPC worker threads only queue operations for it, so COM is never touched
+        # from more than one apartment and the driver survives across requests.
+        self._bravo_driver: Optional[BravoDriver] = None
+        self._work_queue: "queue.Queue[Optional[WorkItem]]" = queue.Queue()
+        # Orders submissions against cleanup() so nothing is queued behind the sentinel
+        self._submit_lock = threading.Lock()
+        # Set by the worker on its way out, whether it stopped cleanly or died
+        self._worker_stopped = False
+        # Signalled alongside every put so the worker can sleep on window messages and
+        # new work at the same time
+        self._work_ready: Any = None
+        if _IS_WINDOWS:
+            self._work_ready = win32event.CreateEvent(None, False, False, None)
+        self._sta_thread = threading.Thread(
+            target=self._run_sta_worker, name="BravoSTA", daemon=True
+        )
+        self._sta_thread.start()
+
     def _configure(self, request: Config) -> None:
-        logging.info(f"Configuring Bravo in thread ID: {threading.get_ident()}")
+        logging.info("Configuring Bravo in thread ID: %s", threading.get_ident())
         self.config = request
         logging.info("Bravo configuration complete")
 
-    def _get_thread_driver(self, force_new: bool = False) -> Any:
-        thread_id = threading.get_ident()
-
-        # Check if we need to initialize COM for this thread
-        if not hasattr(_thread_local, "com_initialized"):
-            logging.info(f"Initializing COM in thread ID: {thread_id}")
-            pythoncom.CoInitialize()
-            _thread_local.com_initialized = True
+    def _run_sta_worker(self) -> None:
+        """Run queued operations on this thread until the shutdown sentinel arrives"""
+        logging.info("Initializing COM in STA worker thread ID: %s", threading.get_ident())
+        _co_initialize()
+        future: "Optional[Future[Any]]" = None
+        try:
+            while True:
+                item = self._next_work_item()
+                if item is None:
+                    break
+                func, args, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self.shutdown:
+                    # Don't start queued work once cleanup() has begun
+                    future.set_exception(RuntimeError("BravoServer is shutting down"))
+                    continue
+                try:
+                    future.set_result(func(*args))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            # If anything escaped the loop, don't leave callers blocked on futures that
+            # nothing will resolve: fail the in-flight one and everything still queued
+            stopped = RuntimeError("Bravo STA worker stopped")
+            if future is not None and not future.done():
+                future.set_exception(stopped)
+            with self._submit_lock:
+                self._worker_stopped = True
+                while True:
+                    try:
+                        item = self._work_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None and not item[2].done():
+                        item[2].set_exception(stopped)
+            self._close_driver()
+            logging.info("Uninitializing COM in STA worker thread")
+            _co_uninitialize()
+
+    def _next_work_item(self) -> Optional[WorkItem]:
+        """Block until work is queued, pumping COM messages while idle on Windows"""
+        if not _IS_WINDOWS:
+            return self._work_queue.get()
+        while True:
+            try:
+                return self._work_queue.get_nowait()
+            except queue.Empty:
+                # Sleep until new work is signalled or a window message arrives
+                win32event.MsgWaitForMultipleObjects(
+                    [self._work_ready], False, win32event.INFINITE, win32event.QS_ALLINPUT
+                )
+                _pump_waiting_messages()
+
+    def _submit(self, item: Optional[WorkItem]) -> None:
+        self._work_queue.put(item)
+        if self._work_ready is not None:
+            win32event.SetEvent(self._work_ready)
+
+    def _run_on_sta(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Queue a call for the STA worker and block until it completes"""
+        future: "Future[Any]" = Future()
+        with self._submit_lock:
+            if self.shutdown or self._worker_stopped or not self._sta_thread.is_alive():
+                raise RuntimeError("Bravo STA worker is not running")
+            self._submit((func, args, future))
+        return future.result()
+
+    def _close_driver(self) -> None:
+        """Close the current driver, if any. Must run on the STA worker."""
+        driver, self._bravo_driver = self._bravo_driver, None
+        if driver is not None:
+            try:
+                logging.info("Closing BravoDriver")
+                driver.close()
+            except Exception as e:
+                logging.warning("Error closing BravoDriver: %s", e)
 
-        # Create or verify existing driver
+    def _get_driver(self, force_new: bool = False) -> BravoDriver:
+        """Return the STA worker's driver, creating it if needed. Must run on the STA worker."""
         try:
-            # If we need a new driver or don't have one
-            if force_new or not hasattr(_thread_local, "driver"):
+            driver = self._bravo_driver
+            # Narrow case: a retry whose pre-run ShowVWorks failed with a lost-connection
+            # HRESULT, so nothing reached VWorks. The probe is that same call tried once
+            # more; if VWorks answers, skip the kill, reconnect and login.
+            if force_new and driver is not None and not driver.run_started and driver.is_healthy():
+                logging.info("Existing BravoDriver is still responsive, reusing it")
+                # Drop events from the failed attempt so they can't satisfy the retry's wait
+                driver.event_queue.clear()
+                return driver
+            # If we need a new driver or don't have one. A driver whose run was handed to
+            # VWorks and never completed (e.g. it timed out) may still be executing, so
+            # it is rebuilt too, which kills VWorks and aborts that run.
+            if force_new or driver is None or driver.run_started:
                 # If we had a previous driver, try to close it properly
-                if hasattr(_thread_local, "driver"):
-                    try:
-                        logging.info(f"Closing previous driver in thread ID: {thread_id}")
-                        _thread_local.driver.close()
-                    except Exception as e:
-                        logging.warning(f"Error closing previous driver: {e}")
-
-                # Force kill VWorks to ensure clean state
-                kill_vworks()
-                time.sleep(0.5)
-
-                # Create new driver
-                logging.info(f"Creating new BravoDriver in thread ID: {thread_id}")
-                _thread_local.driver = BravoDriver(init_com=False)
-                _thread_local.driver.login()
-                logging.info(f"BravoDriver created and logged in for thread ID: {thread_id}")
+                self._close_driver()
+
+                # Create new driver; BravoDriver kills any running VWorks before it
+                # creates the COM object, so no separate kill-and-wait is needed here
+                logging.info("Creating new BravoDriver")
+                driver = self._bravo_driver = BravoDriver(init_com=False)
+                driver.login()
+                logging.info("BravoDriver created and logged in")
             else:
                 # Verify the existing driver is still responsive
                 try:
                     # Try to pump messages which will fail if COM is disconnected
-                    pythoncom.PumpWaitingMessages()
+                    _pump_waiting_messages()
                 except Exception as e:
-                    logging.warning(f"COM connection test failed, recreating driver: {e}")
-                    return self._get_thread_driver(force_new=True)
+                    logging.warning("COM connection test failed, recreating driver: %s", e)
+                    return self._get_driver(force_new=True)
+                # Drop events left over from earlier runs
+                driver.event_queue.clear()
 
-            return _thread_local.driver
+            return driver
 
         except Exception as e:
-            logging.error(f"Failed to create BravoDriver in thread {thread_id}: {e}")
+            logging.error("Failed to create BravoDriver: %s", e)
             # Clean up and try again with a fresh environment
-            if hasattr(_thread_local, "driver"):
-                try:
-                    _thread_local.driver.close()
-                except Exception as e:
-                    logging.warning(f"Failed to close BravoDriver: {e}")
-                delattr(_thread_local, "driver")
+            self._close_driver()
 
             # If this is already a retry, give up to avoid infinite recursion
             if force_new:
@@ -97,34 +221,23 @@ class BravoServer(ToolServer):
 
             # Try once more with force_new=True
             logging.info("Attempting recovery by creating a fresh driver")
-            kill_vworks()  # Make sure VWorks is killed
-            time.sleep(1)  # Give more time for cleanup
-            return self._get_thread_driver(force_new=True)
-
-    def cleanup(self) -> None:
-        """Clean up resources properly for all threads"""
-        logging.info(f"Cleanup called from thread ID: {threading.get_ident()}")
-
-        # Signal shutdown
-        self.shutdown = True
-
-        # Clean up the driver in the current thread if it exists
-        if hasattr(_thread_local, "driver"):
-            try:
-                logging.info(f"Cleaning up driver for thread ID: {threading.get_ident()}")
-                _thread_local.driver.close()
-                delattr(_thread_local, "driver")
-            except Exception as e:
-                logging.error(f"Error closing driver: {e}")
-
-        # Clean up COM in the current thread if it was initialized
-        if hasattr(_thread_local, "com_initialized"):
-            try:
-                logging.info(f"Uninitializing COM in thread ID: {threading.get_ident()}")
-                pythoncom.CoUninitialize()
-                delattr(_thread_local, "com_initialized")
-            except Exception as e:
-                logging.error(f"Error uninitializing COM: {e}")
+            return self._get_driver(force_new=True)
+
+    def cleanup(self, timeout: float = 10) -> None:
+        """Stop the STA worker, closing the driver and COM on its own thread"""
+        logging.info("Cleanup called from thread ID: %s", threading.get_ident())
+
+        # Signal shutdown; the worker rejects anything still queued, then closes the
+        # driver and uninitializes COM when it reaches the sentinel
+        with self._submit_lock:
+            self.shutdown = True
+            self._submit(None)
+        if self._sta_thread.is_alive() and self._sta_thread is not threading.current_thread():
+            self._sta_thread.join(timeout)
+            if self._sta_thread.is_alive():
+                logging.warning(
+                    "STA worker still busy after %ss, killing VWorks to abort the run", timeout
+                )
 
         # Make sure VWorks is killed
         kill_vworks()
@@ -132,70 +245,62 @@ class BravoServer(ToolServer):
     def _execute_with_retry(
         self,
         operation_name: str,
-        operation_func: Callable[[BravoDriver], None],
+        driver_method: Callable[..., None],
+        *args: Any,
         max_retries: int = 2,
     ) -> None:
-        """Execute an operation with automatic retry on RPC errors"""
+        """Call a BravoDriver method on the STA worker with automatic retry on RPC errors"""
+        self._run_on_sta(self._retry_on_sta, operation_name, driver_method, args, max_retries)
+
+    def _retry_on_sta(
+        self,
+        operation_name: str,
+        driver_method: Callable[..., None],
+        args: Tuple[Any, ...],
+        max_retries: int,
+    ) -> None:
         retries = 0
         last_error = None
         while retries <= max_retries:
             try:
                 if retries > 0:
-                    logging.info(f"Retry #{retries} for {operation_name}")
+                    logging.info("Retry #%s for %s", retries, operation_name)
                     # If we're retrying, force a new driver
-                    driver = self._get_thread_driver(force_new=True)
+                    driver = self._get_driver(force_new=True)
                 else:
                     # First attempt uses existing or new driver
-                    driver = self._get_thread_driver()
-
-                # Process COM messages before running
-                if os.name == "nt":
-                    pythoncom.PumpWaitingMessages()
+                    driver = self._get_driver()
 
                 # Run the operation
-                return operation_func(driver)
+                driver_method(driver, *args)
+                return
 
             except Exception as e:
                 last_error = e
-                error_str = str(e)
-
-                # Check if this is an RPC error
-                if (
-                    "RPC server is unavailable" in error_str
-                    or "marshalled for a different thread" in error_str
-                ):
-                    logging.warning(f"RPC connection error in {operation_name}: {e}")
+
+                # Check if this is an RPC error. The driver never leaves the STA worker,
+                # so "marshalled for a different thread" errors can no longer occur.
+                if _is_rpc_error(e) and not self.shutdown:
+                    logging.warning("RPC connection error in %s: %s", operation_name, e)
+                    # The retry reuses the driver if nothing reached VWorks and it still
+                    # answers; otherwise it recreates the driver, killing VWorks first
                     retries += 1
-                    # Force kill VWorks
-                    logging.info("RPC unavailable killing vworks")
-                    kill_vworks()
-                    time.sleep(1)  # Wait before retry
                 else:
-                    # This is not an RPC error, don't retry
-                    logging.error(f"Non-RPC error in {operation_name}: {e}")
+                    # Not an RPC error, or the server is shutting down: don't retry
+                    logging.error("Non-RPC error in %s: %s", operation_name, e)
                     raise
 
         # If we exhausted all retries
-        logging.error(f"Failed {operation_name} after {max_retries} retries")
+        logging.error("Failed %s after %s retries", operation_name, max_retries)
         raise last_error
 
     def RunProtocol(self, params: Command.RunProtocol) -> None:
-        thread_id = threading.get_ident()
-        logging.info(f"RunProtocol called from thread ID: {thread_id}")
-
-        def run_op(driver: BravoDriver) -> None:
-            return driver.run_protocol(params.protocol_file)
-
-        self._execute_with_retry("RunProtocol", run_op)
+        logging.info("RunProtocol called from thread ID: %s", threading.get_ident())
+        self._execute_with_retry("RunProtocol", BravoDriver.run_protocol, params.protocol_file)
 
     def RunRunset(self, params: Command.RunRunset) -> None:
-        thread_id = threading.get_ident()
-        logging.info(f"RunRunset called from thread ID: {thread_id}")
-
-        def run_op(driver: BravoDriver) -> None:
-            return driver.run_runset(params.runset_file)
-
-        self._execute_with_retry("RunRunset", run_op)
+        logging.info("RunRunset called from thread ID: %s", threading.get_ident())
+        self._execute_with_retry("RunRunset", BravoDriver.run_runset, params.runset_file)
 
     def EstimateRunProtocol(self, params: Command.RunProtocol) -> int:
         return 60  # Return a more realistic estimate in seconds
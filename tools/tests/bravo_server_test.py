@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+from collections import deque
+from typing import Any, Deque, List
+from unittest import mock
+
+try:
+    from tools.bravo import server as bravo_server
+    from tools.grpc_interfaces.bravo_pb2 import Command
+except ImportError:  # grpc or the generated protobufs are not available
+    bravo_server = None  # type: ignore[assignment]
+
+
+class StubDriver:
+    """Stands in for BravoDriver so the STA worker can be exercised without VWorks"""
+
+    instances: List["StubDriver"] = []
+
+    def __init__(self, init_com: bool = False) -> None:
+        self.run_started = False
+        self.event_queue: Deque[Any] = deque()
+        self.runs: List[str] = []
+        self.threads: List[str] = []
+        StubDriver.instances.append(self)
+
+    def login(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def is_healthy(self) -> bool:
+        return True
+
+    def run_protocol(self, protocol: str) -> None:
+        self.runs.append(protocol)
+        self.threads.append(threading.current_thread().name)
+
+
+def _run_protocol(protocol: str) -> Any:
+    return Command.RunProtocol(protocol_file=protocol)
+
+
+@unittest.skipIf(bravo_server is None, "gRPC interfaces are not available")
+class TestBravoServerSTAWorker(unittest.TestCase):
+    def setUp(self) -> None:
+        StubDriver.instances = []
+        for target, replacement in (("BravoDriver", StubDriver), ("kill_vworks", lambda: None)):
+            patcher = mock.patch.object(bravo_server, target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.server = bravo_server.BravoServer()
+        self.addCleanup(self.server.cleanup, 1)
+
+    def test_driver_created_once_and_reused(self) -> None:
+        self.server.RunProtocol(_run_protocol("a.pro"))
+        self.server.RunProtocol(_run_protocol("b.pro"))
+        self.assertEqual(len(StubDriver.instances), 1)
+        driver = StubDriver.instances[0]
+        self.assertEqual(driver.runs, ["a.pro", "b.pro"])
+        self.assertEqual(driver.threads, ["BravoSTA", "BravoSTA"])
+
+    def test_exception_reaches_caller(self) -> None:
+        def fail(driver: StubDriver, protocol: str) -> None:
+            raise ValueError(f"bad protocol {protocol}")
+
+        with mock.patch.object(StubDriver, "run_protocol", fail):
+            with self.assertRaisesRegex(ValueError, "bad protocol a.pro"):
+                self.server.RunProtocol(_run_protocol("a.pro"))
+
+    def test_call_after_cleanup_raises(self) -> None:
+        self.server.cleanup(1)
+        with self.assertRaises(RuntimeError):
+            self.server.RunProtocol(_run_protocol("a.pro"))
+
+    def test_queued_items_rejected_on_shutdown(self) -> None:
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(driver: StubDriver, protocol: str) -> None:
+            started.set()
+            release.wait(5)
+
+        results: List[str] = []
+
+        def call() -> None:
+            try:
+                self.server.RunProtocol(_run_protocol("a.pro"))
+                results.append("ok")
+            except RuntimeError as e:
+                results.append(str(e))
+
+        with mock.patch.object(StubDriver, "run_protocol", block):
+            running = threading.Thread(target=call)
+            running.start()
+            self.assertTrue(started.wait(5))
+            queued = threading.Thread(target=call)
+            queued.start()
+            while self.server._work_queue.qsize() == 0:
+                time.sleep(0.01)
+
+            stopping = threading.Thread(target=self.server.cleanup, args=(5,))
+            stopping.start()
+            while not self.server.shutdown:
+                time.sleep(0.01)
+            release.set()
+            for thread in (running, queued, stopping):
+                thread.join(5)
+
+        self.assertEqual(sorted(results), ["BravoServer is shutting down", "ok"])
+
+    def test_second_cleanup_is_harmless(self) -> None:
+        self.server.cleanup(1)
+        self.server.cleanup(1)
+        self.assertFalse(self.server._sta_thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()